@@ -0,0 +1,55 @@
+"""Чистая математика коррекции посадки, компилируется numba (без вызовов krpc)."""
+import math
+
+import numpy as np
+from numba import njit
+
+# --- Константы ---
+R = 600000  # Радиус Кербина (м)
+DEG2RAD = math.pi / 180.0
+R_DEG2RAD = R * DEG2RAD  # Метров на градус дуги по поверхности
+
+# --- Функции ---
+
+@njit(cache=True)
+def angular_velocities(lat, alt, V_north, V_east):
+    """Переводит скорость на север/восток (м/с) в угловые скорости по широте/долготе (град/сек)."""
+    r = R + alt
+
+    # v / r (рад/с) -> град/с, для долготы с учётом cos(lat)
+    ω_lat = V_north / (r * DEG2RAD)
+    ω_lon = V_east / (r * DEG2RAD * math.cos(lat * DEG2RAD))
+
+    return ω_lat, ω_lon
+
+@njit(cache=True)
+def landing_coords(lat, lon, alt, ω_lat, ω_lon, V_alt, target_alt):
+    """Координаты приземления и время до target_alt (с). V_alt должна быть < 0."""
+    t = (alt - target_alt) / abs(V_alt)
+
+    return lat + ω_lat * t, lon + ω_lon * t, t
+
+@njit(cache=True)
+def calculate_required_dV(err, base, coslat=1.0):
+    """Переводит промах [dlat, dlon] (град) в [dV_lat, dV_lon] (м/с).
+
+    base = π * R / (180 * t), coslat = cos(lat) - считаются один раз на попытку.
+    """
+    # Для широты: dV = (dlat * R * π) / (180 * t)
+    # Для долготы: dV = (dlon * R * π * cos(lat)) / (180 * t)
+    multiplier = base * np.array([1.0, coslat])
+
+    return np.where(np.abs(err) < 0.01, 0.0, err * multiplier)
+
+@njit(cache=True)
+def impulse_time(mass, dV_lat, dV_lon, thrust):
+    """Время импульса (с) для набора dV при тяге thrust > 0."""
+    return mass * math.hypot(dV_lat, dV_lon) / thrust
+
+def warmup():
+    """Компилирует функции заранее, чтобы не тратить время в цикле коррекции."""
+    err = np.array([1.0, 1.0])
+    angular_velocities(0.0, 1.0, 1.0, 1.0)
+    landing_coords(0.0, 0.0, 2.0, 1.0, 1.0, -1.0, 1.0)
+    calculate_required_dV(err, 1.0, 1.0)
+    impulse_time(1.0, 1.0, 1.0, 1.0)
@@ -2,66 +2,71 @@ import krpc
 import time
 import math
 
+import numpy as np
+
+import _math
+from _math import DEG2RAD, R_DEG2RAD, calculate_required_dV
+
 # --- Константы ---
-R = 600000  # Радиус Кербина (м)
-TARGET_ALT = 1000  # Высота для завершения коррекции (м)
+TARGET_ALT = 1000.0  # Высота для завершения коррекции (м)
 MISS = 0.2
 
 # --- Функции ---
 
-def get_current_thrust(vessel):
-    """Возвращает текущую доступную тягу всех активных двигателей (в Н)"""
-    return sum(engine.available_thrust 
-              for engine in vessel.parts.engines 
-              if engine.active and engine.has_fuel)
+def get_current_thrust(engine_streams):
+    """Возвращает текущую доступную тягу всех активных двигателей (в Н)
 
-def get_angular_velocities(vessel, dt=1.0):
-    """Возвращает угловые скорости по широте/долготе (град/сек) и вертикальную скорость (м/с)."""
-    lat1, lon1 = vessel.flight().latitude, vessel.flight().longitude
-    alt1 = vessel.flight().surface_altitude
-    
-    time.sleep(dt)
-    
-    lat2, lon2 = vessel.flight().latitude, vessel.flight().longitude
-    alt2 = vessel.flight().surface_altitude
-    
-    ω_lat = (lat2 - lat1) / dt
-    ω_lon = (lon2 - lon1) / dt
-    V_alt = (alt2 - alt1) / dt
+    engine_streams - список потоков (available_thrust, active, has_fuel) по двигателям.
+    """
+    return sum(thrust() 
+              for thrust, active, has_fuel in engine_streams 
+              if active() and has_fuel())
+
+def get_angular_velocities(lat_s, alt_s, vel_s):
+    """Возвращает угловые скорости по широте/долготе (град/сек) и вертикальную скорость (м/с).
+
+    vel_s - поток скорости относительно поверхности в осях (вверх, север, восток).
+    """
+    V_alt, V_north, V_east = vel_s()
+    ω_lat, ω_lon = _math.angular_velocities(lat_s(), alt_s(), V_north, V_east)
     
     return ω_lat, ω_lon, V_alt
 
-def predict_landing_coords(vessel, ω_lat, ω_lon, V_alt):
-    """Прогнозирует координаты приземления."""
+def predict_landing_coords(lat_s, lon_s, alt_s, ω_lat, ω_lon, V_alt):
+    """Прогнозирует координаты приземления и время до TARGET_ALT (с)."""
     if V_alt >= 0:
-        return None, None # Корабль не падает
-    
-    t = (vessel.flight().surface_altitude - TARGET_ALT) / abs(V_alt)
-    pred_lat = vessel.flight().latitude + ω_lat * t
-    pred_lon = vessel.flight().longitude + ω_lon * t
+        return None, None, None # Корабль не падает
     
-    return pred_lat, pred_lon
+    return _math.landing_coords(lat_s(), lon_s(), alt_s(), ω_lat, ω_lon, V_alt, TARGET_ALT)
 
-def calculate_required_dV(dcoord, t, lat=0):
-    """Переводит изменение координат (град) в dV (м/с)."""
-    if abs(dcoord) < 0.01:
-        return 0
-    
-    # Для широты: dV = (dlat * R * π) / (180 * t)
-    # Для долготы: dV = (dlon * R * π * cos(lat)) / (180 * t)
-    multiplier = (math.pi * R) / (180 * t)
-    if abs(lat) > 0.1:  # Для долготы
-        multiplier *= math.cos(math.radians(lat))
-    
-    return dcoord * multiplier
+def make_throttle_setter(control):
+    """Возвращает функцию установки тяги, которая не отправляет RPC, если значение не изменилось."""
+    last = None
 
-def apply_correction(vessel, dV_lat, dV_lon, thr_pow = 0.5):
-    """Применяет корректирующий импульс."""
-    ap = vessel.auto_pilot
-    control = vessel.control
-    
-    ap.reference_frame = vessel.surface_reference_frame
-    ap.engage()
+    def set_throttle(value):
+        nonlocal last
+        if value != last:
+            control.throttle = value
+            last = value
+
+    return set_throttle
+
+def wait_for_orientation(err_s, timeout):
+    """Ждёт, пока ошибка ориентации автопилота станет меньше 5°. Возвращает False по таймауту."""
+    deadline = time.time() + timeout
+    with err_s.condition:
+        while err_s() > 5:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            err_s.wait(remaining)  # Просыпаемся только по обновлению от сервера
+    return True
+
+def apply_correction(ap, set_throttle, lat_s, lon_s, mass_s, engine_streams, err_s, dV_lat, dV_lon, thr_pow = 0.5):
+    """Применяет корректирующий импульс.
+
+    Автопилот уже включён в main в системе отсчёта поверхности, здесь меняется только target_direction.
+    """
     heading = 0
     roll_angle = 0
     # Коррекция по широте (крен)
@@ -85,104 +90,109 @@ def apply_correction(vessel, dV_lat, dV_lon, thr_pow = 0.5):
         #ap.target_direction = (0, 0, heading)
         
     if abs(dV_lon) < 10 or abs(dV_lat) < 10:
-        ap.target_direction = (heading, roll_angle, 0)
+        direction = (heading, roll_angle, 0)
         print("(heading, roll_angle, 0)\n")
     else:
         print("(heading, roll_angle, heading)\n")
-        ap.target_direction = (heading, roll_angle, heading)
-    start_time = time.time()
-    while ap.error > 5:
-        if time.time() - start_time > 20:
-            ap.target_direction = (0, 0, 0)
-            ap.target_direction = (heading, roll_angle, 0)
-        time.sleep(0.5)
+        direction = (heading, roll_angle, heading)
+    ap.target_direction = direction
+    while not wait_for_orientation(err_s, 20):
+        # Не вышли на курс: сначала разворачиваемся в направление посадки, затем пробуем снова
+        ap.target_direction = (0, 0, -1)
+        wait_for_orientation(err_s, 20)
+        ap.target_direction = direction
     time.sleep(1)
     print("Ориентация достигнута!")
     # Расчёт времени импульса
-    mass = vessel.mass
-    dV = math.sqrt(dV_lat**2 + dV_lon**2)
-    thrust = get_current_thrust(vessel)
+    mass = mass_s()
+    thrust = get_current_thrust(engine_streams)
     if thrust > 0:
-        impulse_time = (mass * dV) / thrust
+        impulse_time = _math.impulse_time(mass, dV_lat, dV_lon, thrust)
     else:
         print("Критическая ошибка: thrust = 0")
         return False
     #impulse_time = (mass * dV) / thrust
     
 
-    lat1, lon1, _ = get_angular_velocities(vessel) 
-    print(f"Velocitys: lat={lat1:.3f}, lon={lon1:.3f}")
     # Даём импульс
     
-    control.throttle = thr_pow
+    set_throttle(thr_pow)
     time.sleep(max(0.05, min(impulse_time, 5)))  # Ограничиваем 5 сек #(impulse_time)
-    control.throttle = 0
-    lat1, lon1, _ = get_angular_velocities(vessel) 
-    print(f"Velocitys: lat={lat1:.3f}, lon={lon1:.3f}")
+    set_throttle(0)
+    print(f"Coords: lat={lat_s():.3f}, lon={lon_s():.3f}")
 
-    # Сброс ориентации
-    roll_angle = 0
-    heading = 0
-    """ap.target_roll = 0
-    ap.target_heading = 0
-    ap.disengage() """
+    # Сброс ориентации: следующая попытка начинает из направления посадки
+    ap.target_direction = (0, 0, -1)
 
-def check_and_correct(vessel, target_lat, target_lon, max_attempts=20):
+def check_and_correct(ap, set_throttle, lat_s, lon_s, alt_s, vel_s, mass_s, engine_streams, err_s, target_lat, target_lon, max_attempts=20):
     """Проверяет точность и корректирует траекторию."""
     for attempt in range(1, max_attempts + 1):
         print(f"\nПопытка коррекции #{attempt}")
         
         # Получаем текущие скорости
-        ω_lat, ω_lon, V_alt = get_angular_velocities(vessel)
-        pred_lat, pred_lon = predict_landing_coords(vessel, ω_lat, ω_lon, V_alt)
+        ω_lat, ω_lon, V_alt = get_angular_velocities(lat_s, alt_s, vel_s)
+        pred_lat, pred_lon, t = predict_landing_coords(lat_s, lon_s, alt_s, ω_lat, ω_lon, V_alt)
         
         while pred_lat is None:
             print(f"Ошибка: корабль не падает! {pred_lat}")
-            ap = vessel.auto_pilot
-            control = vessel.control
-            ap.reference_frame = vessel.surface_reference_frame
-            ap.engage()
             ap.target_direction = (0, 0, -1)
-            start_time = time.time()
-            while ap.error > 5:
-                if time.time() - start_time > 20:
-                    raise RuntimeError("Корабль не стабилизировался")
-                time.sleep(0.1)
+            if not wait_for_orientation(err_s, 20):
+                raise RuntimeError("Корабль не стабилизировался")
             print(f"Ориентация достигнута!")
-            control.throttle = 0.5
+            set_throttle(0.5)
             time.sleep(0.1)
-            control.throttle = 0
-            ω_lat, ω_lon, V_alt = get_angular_velocities(vessel)
-            pred_lat, pred_lon = predict_landing_coords(vessel, ω_lat, ω_lon, V_alt)
+            set_throttle(0)
+            ω_lat, ω_lon, V_alt = get_angular_velocities(lat_s, alt_s, vel_s)
+            pred_lat, pred_lon, t = predict_landing_coords(lat_s, lon_s, alt_s, ω_lat, ω_lon, V_alt)
         
 
 
         # Рассчёт ошибки
-        dlat = target_lat - pred_lat
-        dlon = target_lon - pred_lon
-        t = (vessel.flight().surface_altitude - TARGET_ALT) / abs(V_alt)
+        err = np.array([target_lat - pred_lat, target_lon - pred_lon])
         
-        print(f"Промах: lat={dlat:.3f}°, lon={dlon:.3f}° --------------------")
+        print(f"Промах: lat={err[0]:.3f}°, lon={err[1]:.3f}° --------------------")
         
-        if abs(dlat) < MISS and abs(dlon) < MISS:
+        if np.all(np.abs(err) < MISS):
             print("Точность достигнута!")
             return True
         
         # Рассчёт требуемых dV
-        dV_lat = calculate_required_dV(dlat, t)
-        dV_lon = calculate_required_dV(dlon, t, vessel.flight().latitude)
+        base = R_DEG2RAD / t
+        coslat = math.cos(lat_s() * DEG2RAD)
+        dV_lat, dV_lon = calculate_required_dV(err, base, coslat)
         
         # Применяем коррекцию
-        
-        apply_correction(vessel, dV_lat, dV_lon, 0.5)
+        apply_correction(ap, set_throttle, lat_s, lon_s, mass_s, engine_streams, err_s, dV_lat, dV_lon, 0.5)
     
     print("Достигнут лимит попыток.")
     return False
 
 # --- Главная функция ---
 def main():
+    _math.warmup()  # Компиляция numba до подключения, а не в цикле коррекции
     conn = krpc.connect(name="Precision Landing")
     vessel = conn.space_center.active_vessel
+
+    # Потоки телеметрии: значения присылает сервер, чтение локальное
+    flight = vessel.flight(vessel.surface_reference_frame)
+    lat_s = conn.add_stream(getattr, flight, 'latitude')
+    lon_s = conn.add_stream(getattr, flight, 'longitude')
+    alt_s = conn.add_stream(getattr, flight, 'surface_altitude')
+    mass_s = conn.add_stream(getattr, vessel, 'mass')
+    # Скорость относительно поверхности: начало в центре планеты, оси (вверх, север, восток)
+    surface_frame = conn.space_center.ReferenceFrame.create_hybrid(
+        position=vessel.orbit.body.reference_frame,
+        rotation=vessel.surface_reference_frame)
+    vel_s = conn.add_stream(getattr, vessel.flight(surface_frame), 'velocity')
+    # Список двигателей запрашивается один раз, их состояние идёт потоками
+    engine_streams = [(conn.add_stream(getattr, engine, 'available_thrust'),
+                       conn.add_stream(getattr, engine, 'active'),
+                       conn.add_stream(getattr, engine, 'has_fuel'))
+                      for engine in vessel.parts.engines]
+    ap = vessel.auto_pilot
+    control = vessel.control
+    set_throttle = make_throttle_setter(control)
+    err_s = conn.add_stream(getattr, ap, 'error')
     
     # Целевые координаты (KSC: -0.096944, -74.5575)
     target_lat = -0.096944 #float(input("Введите целевую широту: "))
@@ -194,7 +204,7 @@ def main():
     target_lat = target_lat + target_mis1
     target_lon = target_lon + target_mis2
 
-    lat1, lon1 = vessel.flight().latitude, vessel.flight().longitude
+    lat1, lon1 = lat_s(), lon_s()
     dlat = lat1 - target_lat
     dlon = lon1 - target_lon
     """ if abs(dlat) < 60 and abs(dlon) < 60:
@@ -205,53 +215,51 @@ def main():
             dlon = lon1 - target_lon
             print(f"Коорд: lat={lat1:.3f}, lon={lon1:.3f} , dlat {dlat}, dlon {dlon}")
  """
-    while abs(dlat) > 60 or abs(dlon) > 60:
-        lat1, lon1 = vessel.flight().latitude, vessel.flight().longitude
-        dlat = lat1 - target_lat
-        dlon = lon1 - target_lon
-        time.sleep(0.1)
-        print(f"Coords: lat={lat1:.3f}, lon={lon1:.3f} , dlat {dlat}, dlon {dlon}")
+    print(f"Coords: lat={lat1:.3f}, lon={lon1:.3f} , dlat {dlat}, dlon {dlon}")
+    # Ждём сближения с целью без опроса: просыпаемся по обновлениям потока широты
+    with lat_s.condition:
+        while abs(lat_s() - target_lat) > 60 or abs(lon_s() - target_lon) > 60:
+            lat_s.wait()
+    lat1, lon1 = lat_s(), lon_s()
+    dlat = lat1 - target_lat
+    dlon = lon1 - target_lon
     print(f"Coords: lat={lat1:.3f}, lon={lon1:.3f} , dlat {dlat}, dlon {dlon}")
     print("\nНачинаем коррекцию траектории...")
-    vessel.control.sas = False
+    control.sas = False
     time.sleep(1)
-    vessel.control.sas = True
-    success = check_and_correct(vessel, target_lat, target_lon)
-    vessel.control.sas = False
+    control.sas = True
+    # Автопилот включается один раз, дальше меняется только target_direction
+    ap.reference_frame = vessel.surface_reference_frame
+    ap.engage()
+    success = check_and_correct(ap, set_throttle, lat_s, lon_s, alt_s, vel_s, mass_s, engine_streams, err_s, target_lat, target_lon)
+    control.sas = False
 
     if success:
         print("Корабль приземлится в заданной точке!")
     else:
         print("Требуется ручная коррекция.")
-    ap = vessel.auto_pilot
-    control = vessel.control
-    ap.reference_frame = vessel.surface_reference_frame
-    ap.engage()
-    vessel.control.sas = False
+    control.sas = False
     time.sleep(1)
-    vessel.control.sas = True
+    control.sas = True
     ap.target_direction = (0, 0, -1)
-    start_time = time.time()
-    while ap.error > 5:
-        if time.time() - start_time > 10:
-            raise RuntimeError("Корабль не стабилизировался")
-        time.sleep(0.1)
+    if not wait_for_orientation(err_s, 10):
+        raise RuntimeError("Корабль не стабилизировался")
     print(f"Ориентация для входа в атмосферу и приземления достигнута!")
-    while vessel.flight().surface_altitude > 1500:
-        ap.target_direction = (0, 0, -1)
-        time.sleep(1)
-    vessel.control.activate_next_stage()
-    vessel.control.sas = False
+    with alt_s.condition:
+        while alt_s() > 1500:
+            alt_s.wait()
+    control.activate_next_stage()
+    control.sas = False
     ap.disengage()
-    h = vessel.flight().surface_altitude
+    h = alt_s()
     time.sleep(5)
-    while vessel.flight().surface_altitude - h > 1:
-        print(f"Снижение... {h} {vessel.flight().surface_altitude}")
-        h = vessel.flight().surface_altitude
+    while h - alt_s() > 1:  # Пока за 2 с опустились больше чем на 1 м
+        print(f"Снижение... {h} {alt_s()}")
+        h = alt_s()
         time.sleep(2)
     print(f"\rСнижение... {h}")
-    lat1, lon1 = vessel.flight().latitude, vessel.flight().longitude
-    alt1 = vessel.flight().surface_altitude
+    lat1, lon1 = lat_s(), lon_s()
+    alt1 = alt_s()
     print(f"Снижение завершено координаты приземления {lat1:3f}° {lon1:3f}°")
 
 if __name__ == "__main__":